@@ -11,7 +11,11 @@ setuptools.setup(
     author_email="m.fleischmann@urbandatalab.net",
     python_requires=">=3.8",
     description="UDL.AI Python interface",
-    install_requires=["requests", "pandas"],
+    install_requires=["requests", "numpy", "pandas"],
+    extras_require={
+        "async": ["httpx[http2]"],
+        "fast": ["urllib3[brotli,zstd]", "orjson", "httpx[http2]"],
+    },
     long_description=long_description,
     long_description_content_type="text/markdown",
     include_package_data=True,
@@ -28,6 +28,8 @@ Top-level package for UDL.AI Python API.
 
 """
 
+from ._cache import clear_cache  # noqa
+from ._http import set_session  # noqa
 from ._version import get_versions
 from .feature_api import *  # noqa
 from .geocoding_api import *  # noqa
@@ -0,0 +1,125 @@
+"""
+Copyright 2023- UrbanDataLab AG
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT
+OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+Contact: Martin Fleischmann <m.fleischmann@urbandatalab.net>, 2023
+
+---
+
+On-disk cache of successful API responses.
+
+The cache is an SQLite database in ``~/.cache/udlai`` (or ``UDLAI_CACHE_DIR``).
+Responses expire after a day (or ``UDLAI_CACHE_TTL`` seconds, 0 disables the cache).
+Any failure to read or write the cache is treated as a cache miss, a malformed
+``UDLAI_CACHE_TTL`` disables the cache. Bodies reporting an error are not stored.
+
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+
+def _ttl():
+    """time to live of cached responses in seconds, 0 if malformed"""
+    try:
+        return float(os.environ.get("UDLAI_CACHE_TTL", 86400))
+    except ValueError:
+        return 0
+
+
+def _path():
+    """location of the cache database"""
+    directory = os.path.expanduser(os.environ.get("UDLAI_CACHE_DIR", "~/.cache/udlai"))
+    return os.path.join(directory, "responses.sqlite")
+
+
+def _connect():
+    """open the cache database, creating it if needed"""
+    path = _path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    con = sqlite3.connect(path, timeout=30)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS responses "
+        "(key TEXT PRIMARY KEY, expires REAL, content BLOB)"
+    )
+    # expired entries are pruned on every store, keep that from scanning the table
+    con.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires)")
+    return con
+
+
+def _key(url, token, data=None):
+    """cache key of a request, the token is part of it as access differs per user"""
+    h = hashlib.blake2b(url.encode())
+    h.update(token.encode())
+    if data is not None:
+        h.update(data)
+    return h.hexdigest()
+
+
+def _lookup(key):
+    """return cached content or None if missing or expired"""
+    if _ttl() <= 0:
+        return None
+    try:
+        with closing(_connect()) as con:
+            row = con.execute(
+                "SELECT content FROM responses WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            ).fetchone()
+    except (sqlite3.Error, OSError):
+        return None
+    return None if row is None else row[0]
+
+
+def _store(key, content):
+    """store content under key and drop expired entries"""
+    ttl = _ttl()
+    if ttl <= 0:
+        return
+    now = time.time()
+    try:
+        with closing(_connect()) as con, con:
+            con.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+            con.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, now + ttl, content),
+            )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def clear_cache():
+    """
+    Remove all API responses stored in the on-disk cache.
+
+    Successful responses are cached for a day in ``~/.cache/udlai`` so that repeated
+    queries do not hit the API. The location can be changed using the
+    ``UDLAI_CACHE_DIR`` environment variable and the time to live (in seconds) using
+    ``UDLAI_CACHE_TTL``. Set ``UDLAI_CACHE_TTL=0`` to disable the cache.
+
+    Examples
+    --------
+    >>> udlai.clear_cache()
+    """
+    with closing(_connect()) as con, con:
+        con.execute("DELETE FROM responses")
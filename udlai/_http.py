@@ -0,0 +1,235 @@
+"""
+Copyright 2023- UrbanDataLab AG
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT
+OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+Contact: Martin Fleischmann <m.fleischmann@urbandatalab.net>, 2023
+
+---
+
+HTTP layer shared by all API modules.
+
+"""
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from . import _cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API_URL = "https://api.udl.ai/api/v1/public"
+
+# maximum number of requests in flight when a query is split into chunks
+_MAX_WORKERS = 8
+# (connect, read) timeout in seconds, an unreachable API fails fast
+_TIMEOUT = (5, 60)
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _default_adapter():
+    """connection pool with retries on transient failures"""
+    retries = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 502, 503, 504],
+        # all POST endpoints are read-only queries, safe to retry
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,
+    )
+    return HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retries)
+
+
+# connection pool shared by the sessions of all threads
+_ADAPTER = _default_adapter()
+_LOCAL = threading.local()
+# session set by the user via set_session, if any
+_SESSION = None
+
+
+def _default_session():
+    """session reusing pooled connections across calls"""
+    session = requests.Session()
+    session.mount("https://", _ADAPTER)
+    # advertises br and zstd only if brotli and zstandard are installed to decode them
+    session.headers.update(
+        {"Content-Type": "application/json", "Accept-Encoding": ACCEPT_ENCODING}
+    )
+    return session
+
+
+def _session():
+    """session set by the user or the default session of the current thread"""
+    if _SESSION is not None:
+        return _SESSION
+    session = getattr(_LOCAL, "session", None)
+    if session is None:
+        session = _LOCAL.session = _default_session()
+    return session
+
+
+def set_session(session=None):
+    """
+    Set the ``requests.Session`` used to communicate with the UDL.AI API.
+
+    By default, ``udlai`` gives each thread its own session, all sharing a single
+    pool of persistent connections, so that consecutive calls do not negotiate a new
+    connection. Use this function to supply your own session, e.g. with a larger
+    connection pool or a proxy configuration. The supplied session is used by all
+    threads.
+
+    Parameters
+    ----------
+    session : requests.Session, optional
+        Session to be used by all subsequent calls. If None, the default sessions are
+        restored.
+
+    Examples
+    --------
+    >>> import requests
+    >>> from requests.adapters import HTTPAdapter
+    >>> session = requests.Session()
+    >>> session.mount("https://", HTTPAdapter(pool_maxsize=64))
+    >>> udlai.set_session(session)
+    """
+    global _SESSION
+
+    _SESSION = session
+
+
+def _get(url, token):
+    """GET request authorized by token"""
+    return _cached(
+        url,
+        token,
+        None,
+        lambda: _session().get(url, headers=_auth_headers(token), timeout=_TIMEOUT),
+    )
+
+
+def _post(url, token, json_data, error_in_body=False):
+    """POST request authorized by token, json_data may already be serialized"""
+    # error_in_body marks endpoints reporting some errors with status 200
+    data = json_data if isinstance(json_data, bytes) else _dumps(json_data)
+    return _cached(
+        url,
+        token,
+        data,
+        lambda: _session().post(
+            url,
+            headers=_auth_headers(token, json_body=True),
+            data=data,
+            timeout=_TIMEOUT,
+        ),
+        error_in_body=error_in_body,
+    )
+
+
+@lru_cache(maxsize=32)
+def _auth_headers(token, json_body=False):
+    """headers authorizing requests by token, built once and shared by all of them"""
+    headers = {"Authorization": f"Bearer {token}"}
+    if json_body:
+        # a session passed to set_session does not set it on its own
+        headers["Content-Type"] = "application/json"
+    return headers
+
+
+def _cached(url, token, data, send, error_in_body=False):
+    """return a cached response to the request or send it and cache the result"""
+    if _cache._ttl() <= 0:
+        return send()
+
+    key = _cache._key(url, token, data)
+    content = _cache._lookup(key)
+    if content is not None:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.raw = io.BytesIO(content)
+        return response
+
+    response = send()
+    # only bodies of endpoints that may report an error with 200 are parsed here
+    if response.status_code == 200 and not (
+        error_in_body and _is_error(response.content)
+    ):
+        _cache._store(key, response.content)
+    return response
+
+
+def _is_error(content):
+    """whether a response body reports an error, some endpoints do so with 200"""
+    try:
+        body = _loads(content)
+    except ValueError:
+        return True
+    return isinstance(body, dict) and "error" in body
+
+
+def _dumps(obj):
+    """serialize obj to JSON bytes, using orjson if available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj).encode()
+
+
+def _loads(content):
+    """parse JSON bytes, using orjson if available"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _chunks(seq, n):
+    """split a sequence into consecutive chunks of at most n items"""
+    for i in range(0, len(seq), n):
+        yield seq[i : i + n]
+
+
+def _executor():
+    """thread pool shared by all chunked queries, created on first use"""
+    global _EXECUTOR
+
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(
+                max_workers=_MAX_WORKERS, thread_name_prefix="udlai"
+            )
+    return _EXECUTOR
+
+
+def _map_chunks(func, chunks):
+    """apply func to each chunk concurrently, preserving the order of chunks"""
+    if len(chunks) <= 1:
+        return [func(chunk) for chunk in chunks]
+
+    return list(_executor().map(func, chunks))
@@ -28,38 +28,98 @@ Definition of the main API.
 
 """
 import warnings
-from collections import defaultdict
+from functools import lru_cache, partial
+from itertools import chain
 
-import pandas as pd
-import requests
+from ._http import _TIMEOUT, API_URL, _chunks, _dumps, _get, _loads, _map_chunks, _post
+from ._lazy import _LazyModule
 
-API_URL = "https://api.udl.ai/api/v1/public"
+# pandas and numpy are imported on first use
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas")
 
+# number of points sent to the API within a single request
+_CHUNK = 500
 
-def _flatten_dict(d, parent_key="", sep="."):
-    """recursive function to flatten the response"""
-    items = []
-    for k, v in d.items():
-        new_key = parent_key + sep + k if parent_key else k
-        if isinstance(v, dict):
-            items.extend(_flatten_dict(v, new_key, sep=sep).items())
-        elif isinstance(v, list):
-            for i in v:
-                items.extend(_flatten_dict(i, new_key, sep=sep).items())
+
+def _flatten_dict(d, sep="."):
+    """iterative function to flatten the response
+
+    Nested keys are joined by ``sep``, items of lists are flattened under the key of
+    the list, with the later ones overwriting the earlier ones.
+    """
+    flat = {}
+    stack = [("", iter(d.items()))]
+    while stack:
+        parent_key, items = stack[-1]
+        for k, v in items:
+            new_key = parent_key + sep + k if parent_key else k
+            if isinstance(v, dict):
+                stack.append((new_key, iter(v.items())))
+                break
+            if isinstance(v, list):
+                stack.append((new_key, chain.from_iterable(i.items() for i in v)))
+                break
+            flat[new_key] = v
         else:
-            items.append((new_key, v))
-    return dict(items)
+            stack.pop()
+    return flat
 
 
 def _propagate_error(response):
     """propagate error from the API"""
-    from requests.exceptions import JSONDecodeError
-
     try:
-        r = response.json()
-        raise ValueError(f'{r["error"]}: {r["details"]} [status {r["status"]}]')
-    except JSONDecodeError:
+        r = _loads(response.content)
+    except ValueError:
         raise ValueError(response.text)
+    raise ValueError(f'{r["error"]}: {r["details"]} [status {r["status"]}]')
+
+
+# inferred types of values that are numbers (or missing) only
+_NUMERIC_TYPES = {"integer", "floating", "mixed-integer-float", "empty"}
+
+
+def _to_numeric(values):
+    """convert values to a numeric dtype if all of them are numbers"""
+    # numeric strings such as codes with leading zeros are kept as they are
+    if pd.api.types.infer_dtype(values, skipna=True) in _NUMERIC_TYPES:
+        return pd.to_numeric(values)
+    return values
+
+
+@lru_cache(maxsize=256)
+def _attr_spec(attribute_id):
+    """attributes part of the JSON body, shared by all queries of the same IDs"""
+    return tuple({"id": x} for x in attribute_id)
+
+
+def _geometry_json(geometry):
+    """serialized GeoJSON of a geometry, cached for shapely geometries"""
+    if isinstance(geometry, dict):
+        return _dumps(geometry)
+    if hasattr(geometry, "wkb"):
+        return _wkb_geojson(geometry.wkb)
+    return _dumps(geometry.__geo_interface__)
+
+
+@lru_cache(maxsize=16)
+def _wkb_geojson(wkb):
+    """serialized GeoJSON of a WKB-encoded shapely geometry"""
+    from shapely import wkb as shapely_wkb
+
+    return _dumps(shapely_wkb.loads(wkb).__geo_interface__)
+
+
+def _features_payload(latitude, longitude, attribute_id, grid_size):
+    """JSON body of a single point query"""
+    return {
+        "coordinates": {
+            "latitude": latitude,
+            "longitude": longitude,
+        },
+        "attributes": _attr_spec(tuple(attribute_id)),
+        "grid_size": f"grid{grid_size}",
+    }
 
 
 def attributes(token):
@@ -100,15 +160,9 @@ def attributes(token):
     """
 
     # calling the API
-    response = requests.get(
-        f"{API_URL}/attributes/",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-    )
+    response = _get(f"{API_URL}/attributes/", token)
     if response.status_code == 200:
-        return pd.DataFrame([_flatten_dict(i) for i in response.json()])
+        return pd.DataFrame([_flatten_dict(i) for i in _loads(response.content)])
 
     _propagate_error(response)
 
@@ -161,26 +215,30 @@ def attribute_detail(token, attribute_id):
     """
 
     # calling the API
-    response = requests.get(
-        f"{API_URL}/attributes/{attribute_id}/",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-    )
+    response = _get(f"{API_URL}/attributes/{attribute_id}/", token)
     if response.status_code == 200:
-        return pd.Series(_flatten_dict(response.json()))
+        return pd.Series(_flatten_dict(_loads(response.content)))
 
     _propagate_error(response)
 
 
-def features(token, latitude, longitude, attribute_id, index_by="id", grid_size=25):
+def features(
+    token,
+    latitude,
+    longitude,
+    attribute_id,
+    index_by="id",
+    grid_size=25,
+    dedupe=True,
+    raw=False,
+):
     """
     An API Endpoint that will return the attributes for provided
     coordinates. The API expects the attribute IDs, that can be fetched using
     ``udlai.attributes`` function.
 
-    You can pass individual coordinates or arrays of the same length.
+    You can pass individual coordinates or arrays of the same length. Large arrays
+    are split into chunks of 500 points that are queried concurrently.
 
     https://api.udl.ai/api/v1/docs/public/attributes#tag/features
 
@@ -201,27 +259,34 @@ def features(token, latitude, longitude, attribute_id, index_by="id", grid_size=
         Resolution of the UDL grid to be queried. Smaller resolutions are more precise
         but may contain gaps, larger resolutions are aggregated and are more likely to
         cover entirety of built up area.
+    dedupe : bool
+        Query each unique location only once and map the result back to all of its
+        occurrences. Applies only to multiple points.
+    raw : bool
+        Return a plain dict mapping attributes to values instead of a Series.
+        Applies only to a single point.
 
     Returns
     -------
-    features : pandas.Series or pandas.DataFrame
-        returns Series for a single point or a DataFrame for multiple points
+    features : pandas.Series or pandas.DataFrame or dict
+        returns Series (or dict if ``raw=True``) for a single point or a DataFrame
+        for multiple points
 
     Examples
     --------
     Single point and a single attribute:
 
     >>> udlai.features(token, 47.37, 8.54, 22)
-    22    2.2064113123322
-    Name: (47.37, 8.54), dtype: object
+    22    2.206411
+    Name: (47.37, 8.54), dtype: float64
 
     Single point and multiple attributes, indexed by name
 
     >>> udlai.features(token, 47.37, 8.54, [10, 11, 22], index_by="name")
-    box_length                 104
-    box_perim                  335
-    obj_compact    2.2064113123322
-    Name: (47.37, 8.54), dtype: object
+    box_length     104.000000
+    box_perim      335.000000
+    obj_compact      2.206411
+    Name: (47.37, 8.54), dtype: float64
 
     Multiple points and a single attribute
     (the last point is outside of the covered area):
@@ -229,10 +294,10 @@ def features(token, latitude, longitude, attribute_id, index_by="id", grid_size=
     >>> lats = [47.3769267, 47.3769267, 48.3769267]
     >>> lons = [8.5497381, 8.5417981, 8.9417981]
     >>> udlai.features(token, lats, lons, 10)
-        latitude  longitude    10
-    0  47.376927   8.549738   294
-    1  47.376927   8.541798    44
-    2  48.376927   8.941798  None
+        latitude  longitude     10
+    0  47.376927   8.549738  294.0
+    1  47.376927   8.541798   44.0
+    2  48.376927   8.941798    NaN
 
     Multiple points and a multiple attributes
     (the last point is outside of the covered area):
@@ -241,10 +306,10 @@ def features(token, latitude, longitude, attribute_id, index_by="id", grid_size=
     >>> lons = [8.5497381, 8.5417981, 8.9417981]
     >>> ids = [11, 12, 13, 14, 15, 16, 22]
     >>> udlai.features(token, lats, lons, ids)
-        latitude  longitude    11    12  ...     14    15    16                22
-    0  47.376927   8.549738  1106   259  ...  86215  1041   166  13.1956982144114
-    1  47.376927   8.541798   259    85  ...   6860   294    47  1.60758471341658
-    2  48.376927   8.941798  None  None  ...   None  None  None              None
+        latitude  longitude      11     12  ...       14      15     16         22
+    0  47.376927   8.549738  1106.0  259.0  ...  86215.0  1041.0  166.0  13.195698
+    1  47.376927   8.541798   259.0   85.0  ...   6860.0   294.0   47.0   1.607585
+    2  48.376927   8.941798     NaN    NaN  ...      NaN     NaN    NaN        NaN
     [3 rows x 9 columns]
 
     """
@@ -254,101 +319,343 @@ def features(token, latitude, longitude, attribute_id, index_by="id", grid_size=
         attribute_id = [attribute_id]
 
     if not multi:
-        json_data = {
-            "coordinates": {
-                "latitude": latitude,
-                "longitude": longitude,
-            },
-            "attributes": [
-                {
-                    "id": x,
-                }
-                for x in attribute_id
-            ],
-            "grid_size": f"grid{grid_size}",
-        }
+        values = _features_single(token, latitude, longitude, attribute_id, grid_size)
 
-        # calling the API
-        response = requests.post(
-            f"{API_URL}/features/",
-            headers={
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json",
-            },
-            json=json_data,
+        if not values:
+            warnings.warn(
+                "The location is not within the udl.ai database. "
+                "Have you passed correct coordinates?",
+                stacklevel=2,
+                category=UserWarning,
+            )
+
+        clean = {a["attribute"][index_by]: a["value"] for a in values}
+
+        if raw:
+            return clean
+
+        return _to_numeric(
+            pd.Series(
+                clean,
+                name=f"({latitude}, {longitude})",
+                dtype=None if clean else object,
+            )
         )
-        if response.status_code == 200:
-            dict_raw = response.json()
-
-            if "error" in dict_raw:
-                raise ValueError(dict_raw["details"][0])
-
-            if not dict_raw["values"]:
-                warnings.warn(
-                    "The location is not within the udl.ai database. "
-                    "Have you passed correct coordinates?",
-                    stacklevel=2,
-                    category=UserWarning,
+
+    if len(latitude) == 1:
+        # a single point has a smaller request and response on its own endpoint
+        lat = np.asarray(latitude, dtype=float).item()
+        lon = np.asarray(longitude, dtype=float).item()
+        values = _features_single(token, lat, lon, attribute_id, grid_size)
+
+        if not values:
+            warnings.warn(
+                "Some of the locations are not within the udl.ai database. "
+                "Have you passed correct coordinates?",
+                stacklevel=2,
+                category=UserWarning,
+            )
+
+        d = {"latitude": [lat], "longitude": [lon]}
+        d.update(
+            {
+                a["attribute"][index_by]: _to_numeric(
+                    np.array([a["value"]], dtype=object)
                 )
+                for a in values
+            }
+        )
+        return pd.DataFrame(d)
+
+    query_lat = np.asarray(latitude, dtype=float)
+    query_lon = np.asarray(longitude, dtype=float)
+    inverse = None
+    if dedupe:
+        unique, inverse = np.unique(
+            np.column_stack([query_lat, query_lon]), axis=0, return_inverse=True
+        )
+        if len(unique) < len(query_lat):
+            query_lat, query_lon = unique[:, 0], unique[:, 1]
+        else:
+            inverse = None
+
+    # a single preallocated (point x attribute) matrix, filled by position
+    n = len(query_lat)
+    latitudes = np.empty(n)
+    longitudes = np.empty(n)
+    col_idx = {aid: j for j, aid in enumerate(attribute_id)}
+    values = np.full((n, len(attribute_id)), None, dtype=object)
+    labels = {}
+
+    # each chunk is reduced into its rows as soon as it arrives, so that only the
+    # responses currently being processed are held in memory
+    chunks = list(
+        zip(
+            range(0, n, _CHUNK),
+            _chunks(query_lat, _CHUNK),
+            _chunks(query_lon, _CHUNK),
+        )
+    )
+    missing = any(
+        _map_chunks(
+            partial(
+                _features_multi_chunk,
+                token,
+                attribute_id=attribute_id,
+                grid_size=grid_size,
+                index_by=index_by,
+                latitudes=latitudes,
+                longitudes=longitudes,
+                col_idx=col_idx,
+                values=values,
+                labels=labels,
+            ),
+            chunks,
+        )
+    )
 
-            clean = {a["attribute"][index_by]: a["value"] for a in dict_raw["values"]}
+    if missing:
+        warnings.warn(
+            "Some of the locations are not within the udl.ai database. "
+            "Have you passed correct coordinates?",
+            stacklevel=1,
+            category=UserWarning,
+        )
+
+    d = {"latitude": latitudes, "longitude": longitudes}
+    # attributes not found at any location are dropped, their label is unknown
+    d.update(
+        {
+            labels[aid]: _to_numeric(values[:, j])
+            for aid, j in col_idx.items()
+            if aid in labels
+        }
+    )
+    df = pd.DataFrame(d)
+
+    if inverse is not None:
+        # expand unique locations back to the original order
+        df = df.iloc[inverse.ravel()].reset_index(drop=True)
+    return df
+
+
+def _features_single(token, latitude, longitude, attribute_id, grid_size):
+    """query a single point and return the list of its values"""
+    json_data = _features_payload(latitude, longitude, attribute_id, grid_size)
+
+    # calling the API
+    response = _post(f"{API_URL}/features/", token, json_data, error_in_body=True)
+    if response.status_code == 200:
+        dict_raw = _loads(response.content)
 
-            return pd.Series(clean, name=f"({latitude}, {longitude})", dtype=object)
+        if "error" in dict_raw:
+            raise ValueError(dict_raw["details"][0])
 
-        _propagate_error(response)
+        return dict_raw["values"]
 
+    _propagate_error(response)
+
+
+def _features_multi_chunk(
+    token,
+    chunk,
+    attribute_id,
+    grid_size,
+    index_by,
+    latitudes,
+    longitudes,
+    col_idx,
+    values,
+    labels,
+):
+    """query a chunk of points at once and fill their rows of the output arrays
+
+    Returns True if some of the points are not within the database.
+    """
+    offset, query_lat, query_lon = chunk
     json_data = {
+        # tolist() converts to Python floats at once instead of one by one
         "coordinates": [
             {
                 "latitude": lat,
                 "longitude": lon,
             }
-            for lat, lon in zip(latitude, longitude)
-        ],
-        "attributes": [
-            {
-                "id": x,
-            }
-            for x in attribute_id
+            for lat, lon in zip(query_lat.tolist(), query_lon.tolist())
         ],
+        "attributes": _attr_spec(tuple(attribute_id)),
         "grid_size": f"grid{grid_size}",
     }
 
-    response = requests.post(
-        f"{API_URL}/features/multi/",
+    response = _post(f"{API_URL}/features/multi/", token, json_data)
+
+    if response.status_code == 200:
+        results = _loads(response.content)["results"]
+        # the output rows are preallocated, a short response would leave some unset
+        if len(results) != len(query_lat):
+            raise ValueError(
+                f"The API returned {len(results)} results for {len(query_lat)} "
+                "locations."
+            )
+        return _assemble_multi_result(
+            results,
+            offset,
+            index_by,
+            latitudes,
+            longitudes,
+            col_idx,
+            values,
+            labels,
+        )
+
+    _propagate_error(response)
+
+
+def _assemble_multi_result(
+    results, offset, index_by, latitudes, longitudes, col_idx, values, labels
+):
+    """fill rows starting at offset with the parsed results of a multi-point query
+
+    This is the hot loop for large queries, hence the local bindings and writing
+    into row views rather than indexing the matrix by (row, column) each time.
+    Returns True if some of the points are not within the database.
+    """
+    n = len(results)
+    coordinates = [pt["coordinates"] for pt in results]
+    latitudes[offset : offset + n] = [c["latitude"] for c in coordinates]
+    longitudes[offset : offset + n] = [c["longitude"] for c in coordinates]
+
+    missing = False
+    for i, pt in enumerate(results, offset):
+        pt_values = pt["values"]
+        if not pt_values:
+            missing = True
+            continue
+        row = values[i]
+        for attr in pt_values:
+            attribute = attr["attribute"]
+            aid = attribute["id"]
+            row[col_idx[aid]] = attr["value"]
+            if aid not in labels:
+                labels[aid] = attribute[index_by]
+    return missing
+
+
+async def _afeatures(client, latitude, longitude, attribute_id, index_by, grid_size):
+    """query a single point using an asynchronous client"""
+    response = await client.post(
+        f"{API_URL}/features/",
+        content=_dumps(_features_payload(latitude, longitude, attribute_id, grid_size)),
+    )
+    if response.status_code == 200:
+        dict_raw = _loads(response.content)
+
+        if "error" in dict_raw:
+            raise ValueError(dict_raw["details"][0])
+
+        record = {"latitude": latitude, "longitude": longitude}
+        record.update(
+            {a["attribute"][index_by]: a["value"] for a in dict_raw["values"]}
+        )
+        return record, bool(dict_raw["values"])
+
+    _propagate_error(response)
+
+
+def _async_client(token):
+    """asynchronous client authorized by token"""
+    import importlib.util
+
+    import httpx
+
+    return httpx.AsyncClient(
+        # httpx raises on http2=True if h2 is missing, fall back to HTTP/1.1
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        # all points are queued at once, waiting for a free connection is expected
+        timeout=httpx.Timeout(_TIMEOUT[1], connect=_TIMEOUT[0], pool=None),
         headers={
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json",
         },
-        json=json_data,
     )
 
-    if response.status_code == 200:
-        d = defaultdict(list)
-        missing = False
-        for pt in response.json()["results"]:
-            d["latitude"].append(pt["coordinates"]["latitude"])
-            d["longitude"].append(pt["coordinates"]["longitude"])
-            if pt["values"]:
-                for attr in pt["values"]:
-                    d[attr["attribute"][index_by]].append(attr["value"])
-            else:
-                missing = True
-                for k in d.keys():
-                    if k not in ["latitude", "longitude"]:
-                        d[k].append(None)
-
-        if missing:
-            warnings.warn(
-                "Some of the locations are not within the udl.ai database. "
-                "Have you passed correct coordinates?",
-                stacklevel=1,
-                category=UserWarning,
-            )
 
-        return pd.DataFrame(d)
+async def features_async(
+    token, latitude, longitude, attribute_id, index_by="id", grid_size=25
+):
+    """
+    Asynchronous variant of ``udlai.features`` querying each point concurrently.
 
-    _propagate_error(response)
+    Every point is sent as an individual request and all of them are awaited
+    together, so the total time is close to the time of a single request rather than
+    their sum. Requires ``httpx``. Requests are multiplexed over a single HTTP/2
+    connection if ``h2`` is installed (``pip install httpx[http2]``) and sent over
+    a pool of HTTP/1.1 connections otherwise.
+
+    Parameters
+    ----------
+    token : str
+        API token assigned to a user
+    latitude : list-like
+        list-like of latitudes denoting the locations for a query
+    longitude : list-like
+        list-like of longitudes denoting the locations for a query
+    attribute_id : int or list-like
+        ID(s) of the queried attribute. Use ``udlai.attributes`` to get a list of IDs.
+    index_by : {"id", "name"}
+        One of the ``{"id", "name"}`` denoting whether the output should be indexed
+        using the original attribute ID or its name
+    grid_size : {25, 75, 225, 675}
+        Resolution of the UDL grid to be queried.
+
+    Returns
+    -------
+    features : pandas.DataFrame
+
+    Examples
+    --------
+    >>> lats = [47.3769267, 47.3769267, 48.3769267]
+    >>> lons = [8.5497381, 8.5417981, 8.9417981]
+    >>> await udlai.features_async(token, lats, lons, 10)
+        latitude  longitude      10
+    0  47.376927   8.549738   294.0
+    1  47.376927   8.541798    44.0
+    2  48.376927   8.941798     NaN
+
+    Outside of a running event loop, use ``asyncio.run``:
+
+    >>> asyncio.run(udlai.features_async(token, lats, lons, 10))
+    """
+    import asyncio
+
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        raise ImportError(
+            "features_async requires httpx. "
+            "Install it using `pip install httpx[http2]`."
+        )
+
+    if not pd.api.types.is_list_like(attribute_id):
+        attribute_id = [attribute_id]
+
+    async with _async_client(token) as client:
+        results = await asyncio.gather(
+            *[
+                _afeatures(client, lat, lon, attribute_id, index_by, grid_size)
+                for lat, lon in zip(latitude, longitude)
+            ]
+        )
+
+    if not all(found for _, found in results):
+        warnings.warn(
+            "Some of the locations are not within the udl.ai database. "
+            "Have you passed correct coordinates?",
+            stacklevel=2,
+            category=UserWarning,
+        )
+
+    return pd.DataFrame.from_records([record for record, _ in results])
 
 
 def aggregates(token, geometry, attribute_id, index_by="id", grid_size=25):
@@ -425,37 +732,30 @@ def aggregates(token, geometry, attribute_id, index_by="id", grid_size=25):
         max       mean  median   min        std      sum
     10  135.0  94.268966    94.0  19.0  30.613916  13669.0
     """
-    if not isinstance(geometry, dict):
-        geometry = geometry.__geo_interface__  # shapely.geometry to geojson
-
     if not isinstance(attribute_id, list):
         attribute_id = [attribute_id]
 
-    json_data = {
-        "geometry": geometry,
-        "attributes": [
-            {
-                "id": x,
-            }
-            for x in attribute_id
-        ],
-        "grid_size": f"grid{grid_size}",
-    }
-
-    response = requests.post(
-        f"{API_URL}/aggregates/",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-        json=json_data,
+    json_data = _dumps(
+        {"attributes": _attr_spec(tuple(attribute_id)), "grid_size": f"grid{grid_size}"}
     )
+    # splice the serialized geometry in, so that a polygon is encoded only once
+    json_data = b'{"geometry":' + _geometry_json(geometry) + b"," + json_data[1:]
 
-    if response.status_code == 200:
-        d = {}
-        for att in response.json()["results"]:
-            d[att["attribute"][index_by]] = att["aggregates"]
+    response = _post(f"{API_URL}/aggregates/", token, json_data)
 
-        return pd.DataFrame(d).astype(float).T
+    if response.status_code == 200:
+        results = _loads(response.content)["results"]
+        # union of statistics in order of appearance, missing ones become NaN
+        stats = list(
+            dict.fromkeys(chain.from_iterable(att["aggregates"] for att in results))
+        )
+        # fill the float matrix directly rather than casting and transposing a frame
+        values = np.array(
+            [[att["aggregates"].get(stat) for stat in stats] for att in results],
+            dtype=np.float64,
+        ).reshape(len(results), len(stats))
+        index = [att["attribute"][index_by] for att in results]
+
+        return pd.DataFrame(values, index=index, columns=stats)
 
     _propagate_error(response)
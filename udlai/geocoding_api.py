@@ -27,12 +27,57 @@ Contact: Martin Fleischmann <m.fleischmann@urbandatalab.net>, 2023
 Definition of the geocoding API.
 
 """
-import pandas as pd
-import requests
+from functools import partial
+from itertools import chain
 
+from ._http import API_URL, _chunks, _loads, _map_chunks, _post
+from ._lazy import _LazyModule
 from .feature_api import _propagate_error
 
-API_URL = "https://api.udl.ai/api/v1/public"
+# pandas and numpy are imported on first use
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas")
+
+# number of addresses sent to the API within a single request
+_CHUNK = 200
+
+_GEOCODE_COLS = [
+    "street",
+    "number",
+    "postcode",
+    "town",
+    "latitude",
+    "longitude",
+    "score",
+]
+_GEOCODE_FLOAT_COLS = ["latitude", "longitude", "score"]
+
+
+def _addresses_frame(addresses):
+    """DataFrame of geocoded addresses with the known schema"""
+    df = pd.DataFrame.from_records(
+        [r["address"] for r in addresses], columns=_GEOCODE_COLS
+    )
+    df[_GEOCODE_FLOAT_COLS] = df[_GEOCODE_FLOAT_COLS].astype(np.float64)
+    return df
+
+
+def _geocode(token, kind, addresses):
+    """geocode addresses in concurrent chunks and assemble them in the input order"""
+    results = _map_chunks(
+        partial(_geocode_chunk, token, kind), list(_chunks(addresses, _CHUNK))
+    )
+    return _addresses_frame(list(chain.from_iterable(results)))
+
+
+def _geocode_chunk(token, kind, addresses):
+    """geocode a chunk of addresses and return the list of results"""
+    json_data = {"addresses": addresses}
+    response = _post(f"{API_URL}/geocoding/{kind}/", token, json_data)
+    if response.status_code == 200:
+        return _loads(response.content)["addresses"]
+
+    _propagate_error(response)
 
 
 def geocode_structured(token, df):
@@ -51,6 +96,8 @@ def geocode_structured(token, df):
     denoting the quality of match between the original and the geocoded address. Score
     1 means 1:1 match, score 0 means no match.
 
+    Large inputs are split into chunks of 200 addresses that are geocoded concurrently.
+
     Parameters
     ----------
     token : str
@@ -84,19 +131,7 @@ def geocode_structured(token, df):
     1  butzenstrasse     35     8038  zuerich  47.340733   8.526516  0.980769
 
     """
-    json_data = {"addresses": df.to_dict("records")}
-    response = requests.post(
-        f"{API_URL}/geocoding/structured/",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-        json=json_data,
-    )
-    if response.status_code == 200:
-        return pd.DataFrame([r["address"] for r in response.json()["addresses"]])
-
-    _propagate_error(response)
+    return _geocode(token, "structured", df.to_dict("records"))
 
 
 def geocode_unstructured(token, addresses):
@@ -108,6 +143,7 @@ def geocode_unstructured(token, addresses):
     denoting the quality of match between the original and the geocoded address. Score
     1 means 1:1 match, score 0 means no match.
 
+    Large inputs are split into chunks of 200 addresses that are geocoded concurrently.
 
     Parameters
     ----------
@@ -132,16 +168,4 @@ def geocode_unstructured(token, addresses):
     0  riedgrabenweg     15     8050  zuerich  47.406742   8.558574  0.942308
     1  butzenstrasse     35     8038  zuerich  47.340733   8.526516  0.942308
     """
-    json_data = {"addresses": [{"address": a} for a in addresses]}
-    response = requests.post(
-        f"{API_URL}/geocoding/unstructured/",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-        json=json_data,
-    )
-    if response.status_code == 200:
-        return pd.DataFrame([r["address"] for r in response.json()["addresses"]])
-
-    _propagate_error(response)
+    return _geocode(token, "unstructured", [{"address": a} for a in addresses])
@@ -0,0 +1,62 @@
+"""
+Copyright 2023- UrbanDataLab AG
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT
+OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+Contact: Martin Fleischmann <m.fleischmann@urbandatalab.net>, 2023
+
+---
+
+Shared fixtures for the unit tests of UDL.AI Python API.
+
+"""
+import os
+
+import pytest
+
+import udlai
+
+token = os.environ.get("TOKEN")
+
+
+@pytest.fixture(scope="session")
+def attributes_df():
+    """attribute catalog, fetched once per test session"""
+    return udlai.attributes(token)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def response_cache(request, tmp_path_factory):
+    """keep cached API responses in the pytest cache instead of ~/.cache/udlai"""
+    cache = getattr(request.config, "cache", None)
+    if cache is not None:
+        directory = cache.mkdir("udlai")
+    else:
+        directory = tmp_path_factory.mktemp("udlai")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("UDLAI_CACHE_DIR", str(directory))
+        yield directory
+
+
+@pytest.fixture
+def fresh_cache(tmp_path, monkeypatch):
+    """empty response cache, so that mocked responses are never replayed"""
+    monkeypatch.setenv("UDLAI_CACHE_DIR", str(tmp_path))
+    return tmp_path
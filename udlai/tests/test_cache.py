@@ -0,0 +1,142 @@
+"""
+Copyright 2022 UrbanDataLab AG
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT
+OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+Contact: Martin Fleischmann <m.fleischmann@urbandatalab.net>, 2022
+
+---
+
+Unit tests for the response cache of UDL.AI Python API.
+
+"""
+from contextlib import closing
+
+import pytest
+import responses
+
+import udlai
+from udlai import _cache, _http
+from udlai._http import API_URL
+
+attributes_url = f"{API_URL}/attributes/"
+features_url = f"{API_URL}/features/"
+attributes_response = [{"id": 113, "name": "net_betw_speed"}]
+
+
+def single_response(value):
+    return {
+        "coordinates": {"latitude": 47.37, "longitude": 8.54},
+        "values": [
+            {"attribute": {"id": 113, "name": "net_betw_speed"}, "value": value}
+        ],
+    }
+
+
+@responses.activate
+def test_hit(fresh_cache):
+    responses.add(responses.GET, attributes_url, json=attributes_response)
+    first = udlai.attributes("token")
+    second = udlai.attributes("token")
+    assert len(responses.calls) == 1
+    assert first.equals(second)
+
+
+@responses.activate
+def test_expiry(fresh_cache, monkeypatch):
+    responses.add(responses.GET, attributes_url, json=attributes_response)
+    now = _cache.time.time()
+    udlai.attributes("token")
+    monkeypatch.setattr(_cache.time, "time", lambda: now + 86401)
+    udlai.attributes("token")
+    assert len(responses.calls) == 2
+
+
+@pytest.mark.parametrize("ttl", ["0", "a day"])
+@responses.activate
+def test_disabled(fresh_cache, monkeypatch, ttl):
+    monkeypatch.setenv("UDLAI_CACHE_TTL", ttl)
+    responses.add(responses.GET, attributes_url, json=attributes_response)
+    udlai.attributes("token")
+    udlai.attributes("token")
+    assert len(responses.calls) == 2
+    assert not list(fresh_cache.iterdir())
+
+
+@responses.activate
+def test_clear_cache(fresh_cache):
+    responses.add(responses.GET, attributes_url, json=attributes_response)
+    udlai.attributes("token")
+    udlai.clear_cache()
+    udlai.attributes("token")
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_key_token(fresh_cache):
+    responses.add(responses.GET, attributes_url, json=attributes_response)
+    udlai.attributes("token")
+    udlai.attributes("other_token")
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_key_body(fresh_cache):
+    responses.add(responses.POST, features_url, json=single_response(1.0))
+    responses.add(responses.POST, features_url, json=single_response(2.0))
+    assert udlai.features("token", 47.37, 8.54, 113)[113] == 1.0
+    assert udlai.features("token", 47.37, 8.55, 113)[113] == 2.0
+    assert udlai.features("token", 47.37, 8.54, 113)[113] == 1.0
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_error_not_stored(fresh_cache):
+    error = {"error": "x", "details": ["Attribute `113` not assigned to the user."]}
+    responses.add(responses.POST, features_url, json=error)
+    responses.add(responses.POST, features_url, json=single_response(1.0))
+    with pytest.raises(ValueError, match="not assigned to the user"):
+        udlai.features("token", 47.37, 8.54, 113)
+    assert udlai.features("token", 47.37, 8.54, 113)[113] == 1.0
+    assert len(responses.calls) == 2
+
+
+@pytest.mark.parametrize("ttl", ["0", "86400"])
+@responses.activate
+def test_multi_not_parsed(fresh_cache, monkeypatch, ttl):
+    monkeypatch.setenv("UDLAI_CACHE_TTL", ttl)
+    calls = []
+    loads = _http._loads
+    monkeypatch.setattr(_http, "_loads", lambda c: calls.append(c) or loads(c))
+    body = {"results": [single_response(1.0), single_response(2.0)]}
+    responses.add(responses.POST, f"{API_URL}/features/multi/", json=body)
+    udlai.features("token", [47.37, 47.38], [8.54, 8.54], 113)
+    assert not calls
+
+
+@responses.activate
+def test_expires_index(fresh_cache):
+    responses.add(responses.GET, attributes_url, json=attributes_response)
+    udlai.attributes("token")
+    with closing(_cache._connect()) as con:
+        plan = con.execute(
+            "EXPLAIN QUERY PLAN DELETE FROM responses WHERE expires <= 0"
+        ).fetchall()
+    assert "responses_expires" in str(plan)
@@ -28,25 +28,42 @@ Unit tests for UDL.AI Python API.
 
 """
 
+import asyncio
+import json
 import os
+import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
 import pytest
+import responses
 from shapely.geometry import shape
 
 import udlai
+from udlai._http import API_URL
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 token = os.environ.get("TOKEN")
+requires_token = pytest.mark.skipif(not token, reason="TOKEN env var required")
+requires_httpx = pytest.mark.skipif(httpx is None, reason="httpx required")
 
 
-def test_attributes():
-    df = udlai.attributes(token)
+@requires_token
+def test_attributes(attributes_df):
+    df = attributes_df
     assert isinstance(df, pd.DataFrame)
     assert not df["id"].isna().any()
     assert df.shape[0] > 200
     assert df.shape[1] > 20
 
 
+@requires_token
 @pytest.mark.parametrize("attr_id", [113, 172, 0])
 def test_attribute_detail(attr_id):
     if attr_id != 0:
@@ -58,10 +75,41 @@ def test_attribute_detail(attr_id):
             udlai.attribute_detail(token, attr_id)
 
 
+@pytest.fixture(scope="module")
+def multi_result():
+    lats = [47.3769267, 47.3769267, 48.3769267]
+    lons = [8.5497381, 8.5417981, 8.9417981]
+    with pytest.warns(UserWarning, match="Some of the locations are not within"):
+        return udlai.features(token, lats, lons, [113, 172], index_by="name")
+
+
+@requires_token
 class TestFeatures:
+    @classmethod
+    def setup_class(cls):
+        # independent single-point queries are sent concurrently up front
+        with ThreadPoolExecutor() as executor:
+            cls.single = {
+                attr_id: executor.submit(udlai.features, token, 47.37, 8.54, attr_id)
+                for attr_id in [113, 172]
+            }
+            cls.missing = executor.submit(udlai.features, token, 47.37, 8.54, 0)
+            cls.more_attributes = executor.submit(
+                udlai.features, token, 47.37, 8.54, [113, 172], index_by="name"
+            )
+            cls.grid_size = executor.submit(
+                udlai.features,
+                token,
+                47.37,
+                8.54,
+                [113, 172],
+                index_by="name",
+                grid_size=675,
+            )
+
     @pytest.mark.parametrize("attr_id", [113, 172])
     def test_single(self, attr_id):
-        r = udlai.features(token, 47.37, 8.54, attr_id)
+        r = self.single[attr_id].result()
         assert isinstance(r, pd.Series)
         assert attr_id in r.index
         assert r.shape == (1,)
@@ -69,7 +117,7 @@ class TestFeatures:
 
     def test_missing(self):
         with pytest.raises(ValueError, match="Attribute `0` not assigned to the user."):
-            udlai.features(token, 47.37, 8.54, 0)
+            self.missing.result()
 
     def test_location_empty(self):
         with pytest.warns(UserWarning, match="The location is not within the udl.ai"):
@@ -77,85 +125,293 @@ class TestFeatures:
             assert r.empty
 
     def test_more_attributes(self):
-        r = udlai.features(token, 47.37, 8.54, [113, 172], index_by="name")
+        r = self.more_attributes.result()
         assert isinstance(r, pd.Series)
         assert "net_betw_speed" in r.index
         assert "freiz_300" in r.index
         assert r.shape == (2,)
         assert not pd.isna(113)
 
-    def test_multi(self):
-        lats = [47.3769267, 47.3769267, 48.3769267]
-        lons = [8.5497381, 8.5417981, 8.9417981]
-        with pytest.warns(UserWarning, match="Some of the locations are not within"):
-            r = udlai.features(token, lats, lons, 113)
+    def test_multi(self, multi_result):
+        r = multi_result[["latitude", "longitude", "net_betw_speed"]]
         assert isinstance(r, pd.DataFrame)
         assert r.shape == (3, 3)
-        for c in ["latitude", "longitude", 113]:
-            assert c in r.columns
-        assert r[113].notna().sum() == 2
+        assert r["net_betw_speed"].notna().sum() == 2
 
-    def test_multi_attr(self):
-        lats = [47.3769267, 47.3769267, 48.3769267]
-        lons = [8.5497381, 8.5417981, 8.9417981]
-        with pytest.warns(UserWarning, match="Some of the locations are not within"):
-            r = udlai.features(token, lats, lons, [113, 172], index_by="name")
+    def test_multi_attr(self, multi_result):
+        r = multi_result
         assert isinstance(r, pd.DataFrame)
         assert r.shape == (3, 4)
         for c in ["latitude", "longitude", "net_betw_speed", "freiz_300"]:
             assert c in r.columns
         assert r["net_betw_speed"].notna().sum() == 2
 
+    def test_multi_chunked(self, monkeypatch):
+        monkeypatch.setattr(udlai.feature_api, "_CHUNK", 2)
+        lats = [47.3769267, 47.3769267, 48.3769267]
+        lons = [8.5497381, 8.5417981, 8.9417981]
+        with pytest.warns(UserWarning, match="Some of the locations are not within"):
+            r = udlai.features(token, lats, lons, 113)
+        assert r.shape == (3, 3)
+        assert r["latitude"].tolist() == lats
+        assert r["longitude"].tolist() == lons
+        assert r[113].notna().sum() == 2
+
     def test_grid_size(self):
-        r25 = udlai.features(token, 47.37, 8.54, [113, 172], index_by="name")
-        r675 = udlai.features(
-            token, 47.37, 8.54, [113, 172], index_by="name", grid_size=675
-        )
+        r25 = self.more_attributes.result()
+        r675 = self.grid_size.result()
         assert r25["net_betw_speed"] != r675["net_betw_speed"]
 
 
-class TestAggregate:
-    def setup_method(self):
-        self.geojson = {
-            "type": "Polygon",
-            "coordinates": [
-                [
-                    [8.5367, 47.3712],
-                    [8.5406, 47.3712],
-                    [8.5406, 47.3739],
-                    [8.5367, 47.3739],
-                    [8.5367, 47.3712],
-                ]
-            ],
+def _mock_values(coordinates, attributes):
+    """values of the mocked API, locations north of 48 are outside the database"""
+    if coordinates["latitude"] >= 48:
+        return []
+    return [
+        {
+            "attribute": {"id": a["id"], "name": f"attr_{a['id']}"},
+            # attribute 7 is coded by strings with leading zeros
+            "value": "0012" if a["id"] == 7 else coordinates["longitude"] + a["id"],
         }
-        self.shapely_geom = shape(self.geojson)
+        for a in attributes
+    ]
+
+
+def _features_handler(request):
+    """mocked single point endpoint for httpx"""
+    if request.headers["Authorization"] != "Bearer token":
+        body = {"error": "AuthenticationFailed", "details": "Invalid.", "status": 401}
+        return httpx.Response(401, json=body)
+    payload = json.loads(request.content)
+    if {"id": 0} in payload["attributes"]:
+        body = {"error": "x", "details": ["Attribute `0` not assigned to the user."]}
+        return httpx.Response(200, json=body)
+    coordinates = payload["coordinates"]
+    values = _mock_values(coordinates, payload["attributes"])
+    return httpx.Response(200, json={"coordinates": coordinates, "values": values})
+
+
+@requires_httpx
+class TestFeaturesAsync:
+    def setup_method(self):
+        self.lats = [47.3769267, 47.3769267, 48.3769267]
+        self.lons = [8.5497381, 8.5417981, 8.9417981]
+
+    @pytest.fixture(autouse=True)
+    def mock_client(self, monkeypatch):
+        def client(token):
+            return httpx.AsyncClient(
+                transport=httpx.MockTransport(_features_handler),
+                headers={"Authorization": f"Bearer {token}"},
+            )
+
+        monkeypatch.setattr(udlai.feature_api, "_async_client", client)
+
+    def test_records(self):
+        with pytest.warns(UserWarning, match="Some of the locations are not within"):
+            r = asyncio.run(
+                udlai.features_async(
+                    "token", self.lats, self.lons, [113, 172], index_by="name"
+                )
+            )
+        assert r.columns.tolist() == ["latitude", "longitude", "attr_113", "attr_172"]
+        assert r["latitude"].tolist() == self.lats
+        assert r["longitude"].tolist() == self.lons
+        assert r["attr_113"].tolist()[:2] == [lon + 113 for lon in self.lons[:2]]
+        assert r["attr_172"].isna().tolist() == [False, False, True]
+
+    def test_missing(self):
+        with pytest.raises(ValueError, match="Attribute `0` not assigned to the user."):
+            asyncio.run(udlai.features_async("token", self.lats, self.lons, 0))
 
-    def test_single_shapely(self):
-        r = udlai.aggregates(token, self.shapely_geom, 113)
+    def test_error_propagation(self):
+        with pytest.raises(ValueError, match="AuthenticationFailed"):
+            asyncio.run(udlai.features_async("wrong_token", self.lats, self.lons, 113))
+
+
+@requires_httpx
+def test_async_client_timeout():
+    # all points are queued at once, waiting for a connection must not time out
+    client = udlai.feature_api._async_client("token")
+    assert client.timeout.pool is None
+    assert client.timeout.connect is not None
+    asyncio.run(client.aclose())
+
+
+def _single_callback(request):
+    payload = json.loads(request.body)
+    coordinates = payload["coordinates"]
+    values = _mock_values(coordinates, payload["attributes"])
+    return 200, {}, json.dumps({"coordinates": coordinates, "values": values})
+
+
+def _multi_callback(request):
+    payload = json.loads(request.body)
+    results = [
+        {"coordinates": c, "values": _mock_values(c, payload["attributes"])}
+        for c in payload["coordinates"]
+    ]
+    return 200, {}, json.dumps({"results": results})
+
+
+@pytest.fixture
+def mock_api(fresh_cache):
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.POST, f"{API_URL}/features/", callback=_single_callback
+        )
+        rsps.add_callback(
+            responses.POST, f"{API_URL}/features/multi/", callback=_multi_callback
+        )
+        yield rsps
+
+
+class TestFeaturesMocked:
+    def setup_method(self):
+        # repeated locations, one of them outside the database
+        self.lats = [47.1, 48.5, 47.1, 47.2, 48.5]
+        self.lons = [8.1, 8.5, 8.1, 8.2, 8.5]
+        self.expected = [8.1 + 113, np.nan, 8.1 + 113, 8.2 + 113, np.nan]
+
+    def test_dedupe(self, mock_api):
+        with pytest.warns(UserWarning, match="Some of the locations are not within"):
+            r = udlai.features("token", self.lats, self.lons, 113)
+        assert len(mock_api.calls) == 1
+        posted = json.loads(mock_api.calls[0].request.body)["coordinates"]
+        assert sorted((c["latitude"], c["longitude"]) for c in posted) == [
+            (47.1, 8.1),
+            (47.2, 8.2),
+            (48.5, 8.5),
+        ]
+        assert r.index.tolist() == list(range(5))
+        assert r["latitude"].tolist() == self.lats
+        assert r["longitude"].tolist() == self.lons
+        np.testing.assert_allclose(r[113], self.expected)
+
+    def test_no_dedupe(self, mock_api):
+        with pytest.warns(UserWarning, match="Some of the locations are not within"):
+            r = udlai.features("token", self.lats, self.lons, 113, dedupe=False)
+        posted = json.loads(mock_api.calls[0].request.body)["coordinates"]
+        assert [(c["latitude"], c["longitude"]) for c in posted] == list(
+            zip(self.lats, self.lons)
+        )
+        assert r.index.tolist() == list(range(5))
+        np.testing.assert_allclose(r[113], self.expected)
+
+    @pytest.mark.parametrize("container", [list, pd.Series, np.array])
+    def test_length_one(self, mock_api, container):
+        r = udlai.features("token", container([47.1]), container([8.1]), [113, 172])
+        assert [c.request.url for c in mock_api.calls] == [f"{API_URL}/features/"]
+        expected = pd.DataFrame(
+            {
+                "latitude": [47.1],
+                "longitude": [8.1],
+                113: [8.1 + 113],
+                172: [8.1 + 172],
+            }
+        )
+        pd.testing.assert_frame_equal(r, expected)
+
+    @pytest.mark.parametrize("lat", [47.1, 48.5])
+    def test_length_one_as_multi(self, mock_api, lat):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            one = udlai.features("token", [lat], [8.1], [113, 172])
+            multi = udlai.features(
+                "token", [lat, lat], [8.1, 8.1], [113, 172], dedupe=False
+            )
+        pd.testing.assert_frame_equal(one, multi.iloc[:1])
+
+    def test_length_one_missing(self, mock_api):
+        with pytest.warns(UserWarning, match="Some of the locations are not within"):
+            r = udlai.features("token", [48.5], [8.1], 113)
+        assert r.columns.tolist() == ["latitude", "longitude"]
+        assert r.shape == (1, 2)
+
+    def test_raw(self, mock_api):
+        r = udlai.features("token", 47.1, 8.1, [113, 172], raw=True)
+        assert r == {113: 8.1 + 113, 172: 8.1 + 172}
+
+    def test_single_dtype(self, mock_api):
+        r = udlai.features("token", 47.1, 8.1, [113, 172])
+        assert r.dtype == np.float64
+
+    def test_multi_dtypes(self, mock_api):
+        with pytest.warns(UserWarning, match="Some of the locations are not within"):
+            r = udlai.features("token", self.lats, self.lons, [113, 172])
+        assert (r.dtypes == np.float64).all()
+        assert np.isnan(r.loc[1, 113])
+
+    def test_string_values(self, mock_api):
+        single = udlai.features("token", 47.1, 8.1, [113, 7])
+        assert single.tolist() == [8.1 + 113, "0012"]
+        with pytest.warns(UserWarning, match="Some of the locations are not within"):
+            multi = udlai.features("token", self.lats, self.lons, [113, 7])
+        assert multi[113].dtype == np.float64
+        assert multi[7].isna().tolist() == [False, True, False, False, True]
+        assert multi[7].dropna().tolist() == ["0012", "0012", "0012"]
+
+    def test_short_response(self, fresh_cache):
+        results = [{"coordinates": {"latitude": 47.1, "longitude": 8.1}, "values": []}]
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                f"{API_URL}/features/multi/",
+                json={"results": results},
+            )
+            with pytest.raises(ValueError, match="1 results for 2 locations"):
+                udlai.features("token", [47.1, 47.2], [8.1, 8.2], 113)
+
+
+geojson = {
+    "type": "Polygon",
+    "coordinates": [
+        [
+            [8.5367, 47.3712],
+            [8.5406, 47.3712],
+            [8.5406, 47.3739],
+            [8.5367, 47.3739],
+            [8.5367, 47.3712],
+        ]
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def agg_df():
+    return udlai.aggregates(token, shape(geojson), [113, 172])
+
+
+@requires_token
+class TestAggregate:
+    def test_single_shapely(self, agg_df):
+        r = agg_df.loc[[113]]
         assert isinstance(r, pd.DataFrame)
         assert r.shape == (1, 6)
         for c in ["max", "mean", "median", "min", "std", "sum"]:
             assert c in r.columns
         assert r.loc[113].notna().sum() == 6
 
-    def test_single_shapely_name(self):
-        r = udlai.aggregates(token, self.shapely_geom, 113, index_by="name")
+    def test_single_shapely_name(self, agg_df, attributes_df):
+        names = attributes_df.set_index("id")["name"]
+        r = agg_df.loc[[113]].rename(index=names)
         assert isinstance(r, pd.DataFrame)
         assert r.shape == (1, 6)
         for c in ["max", "mean", "median", "min", "std", "sum"]:
             assert c in r.columns
         assert r.loc["net_betw_speed"].notna().sum() == 6
 
-    def test_multi_shapely(self):
-        r = udlai.aggregates(token, self.shapely_geom, [113, 172])
+    def test_multi_shapely(self, agg_df):
+        r = agg_df
         assert isinstance(r, pd.DataFrame)
         assert r.shape == (2, 6)
         for c in ["max", "mean", "median", "min", "std", "sum"]:
             assert c in r.columns
         assert r.loc[113].notna().sum() == 6
 
-    def test_multi_shapely_name(self):
-        r = udlai.aggregates(token, self.shapely_geom, [113, 172], index_by="name")
+    def test_multi_shapely_name(self, agg_df, attributes_df):
+        names = attributes_df.set_index("id")["name"]
+        r = agg_df.rename(index=names)
         assert isinstance(r, pd.DataFrame)
         assert r.shape == (2, 6)
         for c in ["max", "mean", "median", "min", "std", "sum"]:
@@ -163,21 +419,53 @@ class TestAggregate:
         assert r.loc["net_betw_speed"].notna().sum() == 6
         assert r.loc["freiz_300"].notna().sum() == 6
 
-    def test_single_geojson(self):
-        r = udlai.aggregates(token, self.geojson, 113)
+    def test_single_geojson_name(self):
+        r = udlai.aggregates(token, geojson, 113, index_by="name")
         assert isinstance(r, pd.DataFrame)
         assert r.shape == (1, 6)
         for c in ["max", "mean", "median", "min", "std", "sum"]:
             assert c in r.columns
-        assert r.loc[113].notna().sum() == 6
-
+        assert r.loc["net_betw_speed"].notna().sum() == 6
 
-def test_error_propagation():
-    with pytest.raises(ValueError, match="AuthenticationFailed"):
-        udlai.attributes("wrong_token")
 
-    with pytest.raises(ValueError, match="AuthenticationFailed"):
-        udlai.attribute_detail("wrong_token", 113)
+@responses.activate
+def test_aggregates_differing_stats(fresh_cache):
+    results = [
+        {
+            "attribute": {"id": 113, "name": "attr_113"},
+            "aggregates": {"max": 2, "mean": 1.5},
+        },
+        {
+            "attribute": {"id": 172, "name": "attr_172"},
+            "aggregates": {"mean": 0.5, "sum": 3},
+        },
+    ]
+    responses.add(responses.POST, f"{API_URL}/aggregates/", json={"results": results})
+    r = udlai.aggregates("token", geojson, [113, 172])
+    expected = pd.DataFrame(
+        {"max": [2, np.nan], "mean": [1.5, 0.5], "sum": [np.nan, 3]}, index=[113, 172]
+    )
+    pd.testing.assert_frame_equal(r, expected)
+
+
+@pytest.mark.parametrize(
+    "func, args",
+    [
+        (udlai.attributes, ()),
+        (udlai.attribute_detail, (113,)),
+        (udlai.features, (47.37, 8.54, 0)),
+    ],
+)
+@responses.activate
+def test_error_propagation(func, args):
+    body = {
+        "error": "AuthenticationFailed",
+        "details": "Invalid token.",
+        "status": 401,
+    }
+    api = re.compile(r"https://api\.udl\.ai/.*")
+    responses.add(responses.GET, api, json=body, status=401)
+    responses.add(responses.POST, api, json=body, status=401)
 
     with pytest.raises(ValueError, match="AuthenticationFailed"):
-        udlai.features("wrong_token", 47.37, 8.54, 0)
+        func("wrong_token", *args)
@@ -27,16 +27,22 @@ Contact: Martin Fleischmann <m.fleischmann@urbandatalab.net>, 2022
 Unit tests for UDL.AI Python API.
 
 """
+import json
 import os
 
 import numpy as np
 import pandas as pd
+import pytest
+import responses
 
 import udlai
+from udlai._http import API_URL
 
 token = os.environ.get("TOKEN")
+requires_token = pytest.mark.skipif(not token, reason="TOKEN env var required")
 
 
+@requires_token
 def test_geocode_structured():
     df = pd.DataFrame(
         {
@@ -55,6 +61,7 @@ def test_geocode_structured():
     assert not r.isna().any().any()
 
 
+@requires_token
 def test_geocode_unstructured():
     addresses = [
         "Klosbachstrasse 67, 8032 Zürich",
@@ -67,3 +74,42 @@ def test_geocode_unstructured():
         == ["street", "number", "postcode", "town", "latitude", "longitude", "score"]
     )
     assert not r.isna().any().any()
+
+
+def _geocode_callback(request):
+    addresses = json.loads(request.body)["addresses"]
+    results = [
+        {
+            "address": {
+                "street": a["address"].split()[0].lower(),
+                "number": "1",
+                "postcode": "8000",
+                "town": "zuerich",
+                "latitude": 47.0,
+                "longitude": 8.0,
+                "score": 0.9,
+            }
+        }
+        for a in addresses
+    ]
+    return 200, {}, json.dumps({"addresses": results})
+
+
+@responses.activate
+def test_geocode_unstructured_chunked(fresh_cache, monkeypatch):
+    monkeypatch.setattr(udlai.geocoding_api, "_CHUNK", 1)
+    responses.add_callback(
+        responses.POST,
+        f"{API_URL}/geocoding/unstructured/",
+        callback=_geocode_callback,
+    )
+    addresses = [
+        "Klosbachstrasse 67, 8032 Zürich",
+        "Dorfstrasse 40, 3184 Wünnewil-Flamatt, Switzerland",
+        "Riedgrabenweg 15, 8050 Zürich",
+    ]
+    r = udlai.geocode_unstructured("token", addresses)
+    assert len(responses.calls) == 3
+    assert r.shape == (3, 7)
+    assert r.index.tolist() == [0, 1, 2]
+    assert r["street"].tolist() == ["klosbachstrasse", "dorfstrasse", "riedgrabenweg"]
@@ -0,0 +1,61 @@
+"""
+Copyright 2022 UrbanDataLab AG
+
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this
+software and associated documentation files (the "Software"), to deal in the Software
+without restriction, including without limitation the rights to use, copy, modify,
+merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to the following
+conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR
+PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT
+OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+Contact: Martin Fleischmann <m.fleischmann@urbandatalab.net>, 2022
+
+---
+
+Unit tests for the HTTP layer of UDL.AI Python API.
+
+"""
+import requests
+import responses
+
+import udlai
+from udlai._http import API_URL
+
+single_response = {
+    "coordinates": {"latitude": 47.37, "longitude": 8.54},
+    "values": [{"attribute": {"id": 113, "name": "net_betw_speed"}, "value": 1.5}],
+}
+
+
+@responses.activate
+def test_default_session_content_type(fresh_cache):
+    responses.add(responses.POST, f"{API_URL}/features/", json=single_response)
+    udlai.features("token", 47.37, 8.54, 113)
+    headers = responses.calls[0].request.headers
+    assert headers["Content-Type"] == "application/json"
+    assert headers["Authorization"] == "Bearer token"
+
+
+@responses.activate
+def test_set_session_content_type(fresh_cache):
+    responses.add(responses.POST, f"{API_URL}/features/", json=single_response)
+    udlai.set_session(requests.Session())
+    try:
+        udlai.features("token", 47.37, 8.54, 113)
+    finally:
+        udlai.set_session()
+    headers = responses.calls[0].request.headers
+    assert headers["Content-Type"] == "application/json"
+    assert headers["Authorization"] == "Bearer token"